@@ -152,14 +152,30 @@ class GetInfoResp(CBORResponse):
     Constructs the response object based on the capabilities of
     the authenticator
 
+    The response rarely changes once constructed, so the CBOR encoding
+    is cached and only regenerated after one of the setters has been
+    called.
+
     """
     def __init__(self, aaguid:bytes):
         super(GetInfoResp,self).__init__()
         self.set_check = {}
+        self._encoded = None
         # Default to internal AAGUID
         self.content[AUTHN_GETINFO.AAGUID.value] = aaguid
         #self.set_default_options()
 
+    def get_encoded(self)->bytes:
+        """Gets the CBOR encoded response, encoding it only if it has
+        changed since the last call
+
+        Returns:
+            bytes: CBOR encoded version of response contents
+        """
+        if self._encoded is None:
+            self._encoded = super(GetInfoResp,self).get_encoded()
+        return self._encoded
+
     def set_default_options(self):
         """Sets default options for GetInfo
         """
@@ -180,6 +196,7 @@ class GetInfoResp(CBORResponse):
         if not parameter.value in self.content:
             self.content[parameter.value] = {}
         self.content[parameter.value][field.value]=value
+        self._encoded = None
 
     def _add_dict_to_list(self, parameter: AUTHN_GETINFO, value: dict):
         """For list parameters create or add the passed dictionary to the list
@@ -191,6 +208,7 @@ class GetInfoResp(CBORResponse):
         if not parameter.value in self.content:
             self.content[parameter.value] = []
         self.content[parameter.value].append(value)
+        self._encoded = None
 
     def _add_to_list(self, parameter: AUTHN_GETINFO, value: AUTHN_GETINFO_PARAMETER):
         """adds a value to a parameter that is supposed to a list of values
@@ -209,6 +227,7 @@ class GetInfoResp(CBORResponse):
         if not value.value in self.set_check[parameter.value]:
             self.content[parameter.value].append(value.value)
             self.set_check[parameter.value].add(value.value)
+            self._encoded = None
         else:
             raise Exception("Duplicate value in list or sequence")
 
@@ -254,6 +273,7 @@ class GetInfoResp(CBORResponse):
             aaguid (UUID): AAGUID for authenticator
         """
         self.content[AUTHN_GETINFO.AAGUID.value] = aaguid.bytes
+        self._encoded = None
 
     def set_option(self, option: AUTHN_GETINFO_OPTION, value: bool):
         """Sets one of the option values
@@ -272,6 +292,7 @@ class GetInfoResp(CBORResponse):
             value ([type]): value to set, could string, dictionary, etc.
         """
         self.content[parameter.value] = value
+        self._encoded = None
 
     def add_transport(self, transport: AUTHN_GETINFO_TRANSPORT):
         """Add a transport parameter
@@ -38,11 +38,13 @@ from uuid import UUID
 import time
 import shutil
 import logging
+import hashlib
+import hmac
+from collections import OrderedDict
 from fido2 import cbor
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import hashes, hmac
 
 from hid.ctap import CTAPHID
 from hid.usb import USBHID
@@ -64,6 +66,7 @@ from crypto.es256_crypto_provider import ES256CryptoProvider
 
 log = logging.getLogger('debug')
 auth = logging.getLogger('debug.auth')
+_BACKEND = default_backend()
 
 
 class DICEAuthenticator(DICEAuthenticatorListener,ABC):
@@ -77,6 +80,8 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
     """
     AUTHENTICATOR_AAGUID = UUID("695e437f-c0cd-4fe8-b545-d39084f5c805")
     PIN_TOKEN_LENGTH = 64
+    SHARED_SECRET_CACHE_SIZE = 32
+    SHARED_SECRET_CACHE_TTL = 60
     def __init__(self, pin_token_length=PIN_TOKEN_LENGTH,
             ui:DICEAuthenticatorUI=ConsoleAuthenticatorUI()):
         self._create_debug_logs()
@@ -84,11 +89,15 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         self._last_get_assertion_params =  None
         self._last_get_assertion_time = None
         self._last_get_assertion_idx = None
+        #Credentials found by the pending GetAssertion, for GetNextAssertion
+        self._last_get_assertion_creds = None
         self._storage = None
         self._usbdevice = None
         self._usbhid = None
         self._ctaphid = None
         self._authenticator_key_agreement_key=None
+        self._shared_secret_cache = OrderedDict()
+        self._shared_secret_cache_key = os.urandom(32)
         self._pin_crypto_provider= ES256CryptoProvider()
         self._generate_authenticator_key_agreement_key()
         self._generate_pin_token(pin_token_length)
@@ -185,6 +194,13 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         auth.debug("Generating new authenticatorKeyAgreementKey")
         self._authenticator_key_agreement_key = \
             self._get_pin_crypto_provider().create_new_key_pair()
+        self._clear_shared_secrets()
+
+    def _clear_shared_secrets(self):
+        """Clears all cached shared secrets. Must be called whenever the
+        authenticator key agreement key changes
+        """
+        self._shared_secret_cache.clear()
 
     def get_aaguid(self)->UUID:
         """Get the Authenticator AA GUID
@@ -292,6 +308,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         self._last_get_assertion_params =  None
         self._last_get_assertion_time = None
         self._last_get_assertion_idx = None
+        self._last_get_assertion_creds = None
 
     def get_last_assertion_cid(self)->bytes:
         """Get the channel ID of the currently set GetAssertion
@@ -341,6 +358,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_NOT_ALLOWED,"No last assertions found")
         if int(time.time())-self._last_get_assertion_time >30:
             auth.debug("Last assertion has timed out")
+            self.clear_get_last_assertion()
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_NOT_ALLOWED,
                 "Last assertion has timed out")
@@ -463,9 +481,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         Returns:
             bytes: containing concatenated authenticator data
         """
-        digest = hashes.Hash(hashes.SHA256(),default_backend())
-        digest.update(credential_source.get_rp_entity().get_id().encode('UTF-8'))
-        data = digest.finalize()
+        data = hashlib.sha256(credential_source.get_rp_entity().get_id().encode('UTF-8')).digest()
         flags = 0
 
         if up:
@@ -521,9 +537,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
             bytes Concatenated authenticator data
         """
 
-        digest = hashes.Hash(hashes.SHA256(),default_backend())
-        digest.update(credential_source.get_rp_entity().get_id().encode('UTF-8'))
-        data = digest.finalize()
+        data = hashlib.sha256(credential_source.get_rp_entity().get_id().encode('UTF-8')).digest()
         flags = 0
 
         if up:
@@ -549,7 +563,11 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
     def _generate_shared_secret(self,key_agreement:dict)->bytes:
         """Generate a shared secret for the PIN authorisation.
 
-        This generates the shared secret by performing a partial ECDH
+        This generates the shared secret by performing a partial ECDH. The result
+        is cached for SHARED_SECRET_CACHE_TTL seconds against the platform public
+        key, so successive PIN operations from the same platform session do not
+        repeat the ECDH. The cache is indexed by an HMAC of the public key under a
+        random key that only exists for the lifetime of this process.
 
         Args:
             key_agreement (dict): key agreement dictionary containing a public key
@@ -557,10 +575,25 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         Returns:
             bytes: generated share secret
         """
+        cache_hmac = hmac.new(self._shared_secret_cache_key, key_agreement[-2], hashlib.sha256)
+        cache_hmac.update(key_agreement[-3])
+        cache_key = cache_hmac.digest()
+        now = time.monotonic()
+        cached = self._shared_secret_cache.get(cache_key)
+        if not cached is None and cached[1] > now:
+            self._shared_secret_cache.move_to_end(cache_key)
+            return cached[0]
+
         platform_key_agreement_key = \
             self._get_pin_crypto_provider().public_key_from_cose(key_agreement)
-        return self._authenticator_key_agreement_key.get_private_key().exchange(
+        shared_secret = self._authenticator_key_agreement_key.get_private_key().exchange(
             platform_key_agreement_key.get_public_key())
+        self._shared_secret_cache[cache_key] = (shared_secret,
+            now + DICEAuthenticator.SHARED_SECRET_CACHE_TTL)
+        self._shared_secret_cache.move_to_end(cache_key)
+        while len(self._shared_secret_cache) > DICEAuthenticator.SHARED_SECRET_CACHE_SIZE:
+            self._shared_secret_cache.popitem(last=False)
+        return shared_secret
 
     def _calculate_pin_auth(self, *args)->bytes:
         """Calculate the PIN authorisation and return it
@@ -572,12 +605,10 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         Returns:
             bytes: HMAC of parameters from 1 onwards
         """
-        hmac_hash = hmac.HMAC(args[0], hashes.SHA256(),default_backend())
-        argitr = iter(args)
-        next(argitr)
-        for val in argitr:
+        hmac_hash = hmac.new(args[0], digestmod=hashlib.sha256)
+        for val in args[1:]:
             hmac_hash.update(val)
-        return hmac_hash.finalize()
+        return hmac_hash.digest()
 
     def _decrypt_value(self, shared_secret:bytes, ciphertext:bytes)->bytes:
         """Decrypts a value used AES CBC and used by the PIN
@@ -590,7 +621,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         Returns:
             bytes: decrypted cipher text
         """
-        cipher = Cipher(algorithms.AES(shared_secret), modes.CBC(bytes(16)),default_backend())
+        cipher = Cipher(algorithms.AES(shared_secret), modes.CBC(bytes(16)),_BACKEND)
         decryptor = cipher.decryptor()
         return decryptor.update(ciphertext) + decryptor.finalize()
 
@@ -604,7 +635,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
         Returns:
             bytes: encrypted cipher text
         """
-        cipher = Cipher(algorithms.AES(shared_secret), modes.CBC(bytes(16)),default_backend())
+        cipher = Cipher(algorithms.AES(shared_secret), modes.CBC(bytes(16)),_BACKEND)
         encryptor = cipher.encryptor()
         return encryptor.update(plaintext) + encryptor.finalize()
     def _extract_pin(self, pin_bytes:bytes)->str:
@@ -620,24 +651,6 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
             if pin_bytes[i]== b'\x00'[0]:
                 return pin_bytes[:i].decode('utf-8')
 
-    def _sha256(self, value)->bytes:
-        """Calculates the SHA256 of the specified value, encoding
-        appropriately first
-
-        Args:
-            value (str or bytes): value to hash, if string will encode to bytes
-
-        Returns:
-            bytes: hash of value
-        """
-        digest = hashes.Hash(hashes.SHA256(),default_backend())
-
-        if isinstance(value,str):
-            digest.update(value.encode())
-        else:
-            digest.update(value)
-        return digest.finalize()
-
     def _check_pin(self, pin_auth:bytes, pin_protocol:int, client_hash:bytes,
             error_on_no_auth=True)->bool:
         """Checks whether the PIN is valid
@@ -663,7 +676,7 @@ class DICEAuthenticator(DICEAuthenticatorListener,ABC):
                 raise DICEAuthenticatorException(
                     ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_INVALID,"PIN Invalid")
             #verify PIN
-            if pin_auth[:16] == self._calculate_pin_auth(self._pin_token,client_hash)[:16]:
+            if hmac.compare_digest(pin_auth[:16],self._calculate_pin_auth(self._pin_token,client_hash)[:16]):
                 auth.debug("PIN Verified")
                 return True
             else:
@@ -41,6 +41,8 @@ Raises:
 import json
 import logging
 import os
+import stat
+import copy
 import base64
 from typing import  List
 from cryptography.fernet import Fernet
@@ -49,9 +51,11 @@ from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.backends import default_backend
 
 from authenticator.storage import DICEAuthenticatorStorage, DICEAuthenticatorStorageException
+from ctap.constants import AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE
 from ctap.credential_source import PublicKeyCredentialSource
 
 log = logging.getLogger('debug')
+_BACKEND = default_backend()
 
 
 class STORAGE_KEYS():
@@ -71,9 +75,10 @@ class JSONAuthenticatorStorage(DICEAuthenticatorStorage):
     """Concrete implementation of DICEAuthenticatorStorage
     that stores contents in a JSON file
     """
-    def __init__(self, path:str):
+    def __init__(self, path:str, sync_writes:bool=False):
         super().__init__()
         self._path = path
+        self._sync_writes = sync_writes
         if not self._check_exists():
             if not os.path.exists(os.path.dirname(self._path)):
                 os.mkdir(os.path.dirname(self._path))
@@ -169,10 +174,22 @@ class JSONAuthenticatorStorage(DICEAuthenticatorStorage):
     def update_credential_source(self, rp_id: str,
                                  credential_source: PublicKeyCredentialSource) -> bool:
         if not rp_id in self._data[STORAGE_KEYS.CREDENTIALS]:
-            self._data[STORAGE_KEYS.CREDENTIALS][rp_id] = []
-        self._data[STORAGE_KEYS.CREDENTIALS][rp_id] = [credential_source.get_bytes().hex(
-        ) if i == credential_source.get_loaded_bytes().hex() else i for i in self._data[STORAGE_KEYS.CREDENTIALS][rp_id]]
-        return self._write_to_json()
+            return False
+        loaded = credential_source.get_loaded_bytes()
+        if loaded is None:
+            return False
+        loaded = loaded.hex()
+        creds = self._data[STORAGE_KEYS.CREDENTIALS][rp_id]
+        for i, value in enumerate(creds):
+            if value == loaded:
+                new_value = credential_source.get_bytes().hex()
+                if new_value == loaded:
+                    return True
+                creds[i] = new_value
+                return self._write_to_json()
+        #Nothing matched, for example a non-resident credential, so there
+        #is nothing to write
+        return False
 
     def add_credential_source(self,rp_id:str,user_id:bytes,
             credential_source:PublicKeyCredentialSource)->bool:
@@ -193,18 +210,23 @@ class JSONAuthenticatorStorage(DICEAuthenticatorStorage):
         check_allowed=False
         #Checks allow list is set and not empty
         if not allow_list is None and allow_list:
-            allowed = self.convert_allow_list_to_map(allow_list)
+            if isinstance(allow_list,(set,frozenset)):
+                allowed = allow_list
+            else:
+                allowed = self.convert_allow_list_to_map(allow_list)
             check_allowed=True
         results = []
         for value in self._data[STORAGE_KEYS.CREDENTIALS][rp_id]:
+            raw = bytes.fromhex(value)
+            data = json.loads(raw.decode('utf-8'))
+            #Check the ID before loading the key pair so only the allowed
+            #credentials are materialised
+            if check_allowed and not bytes.fromhex(
+                    data[AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE.ID.value]) in allowed:
+                continue
             credential_source = PublicKeyCredentialSource()
-            credential_source.from_bytes(bytes.fromhex(value))
-            if check_allowed:
-                if credential_source.get_id() in allowed:
-                    results.append(credential_source)
-            else:
-                #not allowed list, return everything
-                results.append(credential_source)
+            credential_source.from_dict(data,raw)
+            results.append(credential_source)
         return results
 
     def _get_create_pin(self):
@@ -272,16 +294,63 @@ class JSONAuthenticatorStorage(DICEAuthenticatorStorage):
         self._data[key] = data
         return self._write_to_json()
 
+    def get_data(self)->dict:
+        """Gets a copy of the complete contents of the store, as held in
+        the JSON file
+
+        Returns:
+            dict: copy of the store contents
+        """
+        return copy.deepcopy(self._data)
+
     def reset(self)->bool:
         self._data={"_version":"JSONAuthenticatorStorage_0.1"}
         self._data[STORAGE_KEYS.CREDENTIALS]={}
         self._write_to_json()
         return self.init_new()
 
+    def _write_file(self, contents:bytes):
+        """Writes contents to a temporary file alongside the storage file and
+        then atomically replaces the storage file with it, so an interrupted
+        write cannot leave a truncated file behind
+
+        The temporary file is created with the permissions of the existing
+        storage file, or owner read/write only for a new one, since the
+        store can hold private keys. If sync_writes was set, the file and
+        its directory are also synced to disk so the write survives a power
+        loss. This is off by default as it is slow on SD cards and every
+        signature counter update is a write.
+
+        Args:
+            contents (bytes): complete contents of the storage file
+        """
+        tmp_path = self._path + ".tmp"
+        try:
+            mode = stat.S_IMODE(os.stat(self._path).st_mode)
+        except FileNotFoundError:
+            mode = 0o600
+        fd = os.open(tmp_path,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,mode)
+        #O_CREAT only applies the mode to new files, so also set it for
+        #a temporary file left behind by an earlier failed write
+        os.chmod(tmp_path,mode)
+        with os.fdopen(fd,"wb") as file:
+            file.write(contents)
+            if self._sync_writes:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path,self._path)
+        #Sync the directory so the rename itself survives a power loss
+        if self._sync_writes and hasattr(os,"O_DIRECTORY"):
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self._path)),
+                os.O_RDONLY|os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
     def _write_to_json(self):
         try:
-            with open(self._path,"w") as file:
-                json.dump(self._data, file, indent = 4)
+            self._write_file(json.dumps(self._data, indent = 4).encode("UTF-8"))
             return True
         except EnvironmentError:
             log.error("IO Exception writing JSON", exc_info=True)
@@ -292,11 +361,11 @@ class EncryptedJSONAuthenticatorStorage(JSONAuthenticatorStorage):
     """Concrete implementation of DICEAuthenticatorStorage
     that stores contents in an encrypted JSON file
     """
-    def __init__(self, path:str, pwd:str):
+    def __init__(self, path:str, pwd:str, sync_writes:bool=False):
         self._key = None
         self._salt = None
         self._prep_crypto(pwd,path)
-        super().__init__(path)
+        super().__init__(path,sync_writes)
 
     def _prep_crypto(self,pwd:str, path:str)->bytes:
         """Derives the encryption key from the password
@@ -314,7 +383,7 @@ class EncryptedJSONAuthenticatorStorage(JSONAuthenticatorStorage):
         else:
             self._salt = os.urandom(16)
         kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
-                length=32,salt=self._salt,iterations=100000,backend=default_backend())
+                length=32,salt=self._salt,iterations=100000,backend=_BACKEND)
         self._key = base64.urlsafe_b64encode(kdf.derive(pwd.encode("UTF-8")))
 
     def _write_to_json(self):
@@ -322,9 +391,7 @@ class EncryptedJSONAuthenticatorStorage(JSONAuthenticatorStorage):
             data = json.dumps(self._data)
             fernet = Fernet(self._key)
             token = fernet.encrypt(data.encode("UTF-8"))
-            with open(self._path,"wb") as file:
-                file.write(self._salt)
-                file.write(token)
+            self._write_file(self._salt + token)
             return True
         except EnvironmentError:
             log.error("IO Exception writing Encrypted JSON", exc_info=True)
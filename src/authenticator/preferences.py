@@ -28,6 +28,7 @@
 
 """
 import json
+import os
 from enum import Enum, unique
 
 @unique
@@ -37,6 +38,17 @@ class PREFERENCE_KEY(Enum):
     """
     RK = "resident_key"
     AUTH_STORE = "auth_store"
+    SYNC_WRITES = "sync_writes"
+    STORAGE = "storage"
+    SQLITE_STORE = "sqlite_store"
+
+@unique
+class STORAGE_TYPE(Enum):
+    """Storage backends that can be selected in the preferences
+
+    """
+    JSON = "json"
+    SQLITE = "sqlite"
 class DICEPreferences():
     """ Manages application preferences
     """
@@ -104,3 +116,56 @@ class DICEPreferences():
         """
         self._prefs[PREFERENCE_KEY.AUTH_STORE.value] = value
         self._write_prefs()
+
+    def get_sync_writes(self)->bool:
+        """Get whether storage writes are synced to disk before returning
+
+        Returns:
+            bool: True to sync every storage write, False otherwise, default is False
+        """
+        return self._get_value(PREFERENCE_KEY.SYNC_WRITES,False)
+
+    def set_sync_writes(self, value:bool):
+        """Sets whether storage writes are synced to disk before returning
+
+        Args:
+            value (bool): True to sync every storage write, False if not
+        """
+        self._prefs[PREFERENCE_KEY.SYNC_WRITES.value] = value
+        self._write_prefs()
+
+    def get_storage_type(self)->STORAGE_TYPE:
+        """Get the storage backend to use
+
+        Returns:
+            STORAGE_TYPE: storage backend, default is STORAGE_TYPE.JSON
+        """
+        return STORAGE_TYPE(self._get_value(PREFERENCE_KEY.STORAGE,STORAGE_TYPE.JSON.value))
+
+    def set_storage_type(self, value:STORAGE_TYPE):
+        """Sets the storage backend to use
+
+        Args:
+            value (STORAGE_TYPE): storage backend
+        """
+        self._prefs[PREFERENCE_KEY.STORAGE.value] = value.value
+        self._write_prefs()
+
+    def get_sqlite_store_path(self)->str:
+        """Get the path of the SQLite storage database
+
+        Returns:
+            str: path to the database, defaults to the auth store path
+                with a .db extension
+        """
+        return self._get_value(PREFERENCE_KEY.SQLITE_STORE,
+            os.path.splitext(self.get_auth_store_path())[0] + ".db")
+
+    def set_sqlite_store_path(self, value:str):
+        """Sets the path of the SQLite storage database
+
+        Args:
+            value (str): file path to use for the database
+        """
+        self._prefs[PREFERENCE_KEY.SQLITE_STORE.value] = value
+        self._write_prefs()
@@ -0,0 +1,398 @@
+"""Provides an implementation of DICEAuthenticatorStorage that uses an
+underlying SQLite database to store content
+
+Credentials are held in an indexed table so that lookups by relying party
+and updates to a single credential do not require the whole store to be
+parsed and rewritten. All credential and setting values are encrypted with
+a key derived from the user's password, in the same way as
+EncryptedJSONAuthenticatorStorage.
+
+Classes:
+
+ * :class:`SQLiteAuthenticatorStorage`
+
+Raises:
+    DICEAuthenticatorStorageException: Exception that occurs during storage operations
+
+"""
+"""
+ © Copyright 2020-2021 University of Surrey
+
+ Redistribution and use in source and binary forms, with or without
+ modification, are permitted provided that the following conditions are met:
+
+ 1. Redistributions of source code must retain the above copyright notice,
+ this list of conditions and the following disclaimer.
+
+ 2. Redistributions in binary form must reproduce the above copyright notice,
+ this list of conditions and the following disclaimer in the documentation
+ and/or other materials provided with the distribution.
+
+ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+ LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+ CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+ SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+ INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+ CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+ POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import json
+import logging
+import os
+import base64
+import hashlib
+import hmac
+import sqlite3
+from typing import List
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.backends import default_backend
+
+from authenticator.storage import DICEAuthenticatorStorage, DICEAuthenticatorStorageException
+from authenticator.json_storage import STORAGE_KEYS, JSONAuthenticatorStorage
+from ctap.constants import AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE
+from ctap.credential_source import PublicKeyCredentialSource
+
+log = logging.getLogger('debug')
+_BACKEND = default_backend()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS settings(key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS credentials(id BLOB PRIMARY KEY, rp_id TEXT, blob BLOB);
+CREATE INDEX IF NOT EXISTS idx_rp ON credentials(rp_id);
+"""
+
+class SQLiteAuthenticatorStorage(DICEAuthenticatorStorage):
+    """Concrete implementation of DICEAuthenticatorStorage
+    that stores contents in an encrypted SQLite database
+
+    Credential sources and settings are stored as Fernet tokens. The
+    relying party ID column holds a keyed HMAC of the ID, rather than the
+    ID itself, so it can be indexed without revealing which relying
+    parties the authenticator is registered with.
+    """
+    VERSION = "SQLiteAuthenticatorStorage_0.1"
+    CHECK_VALUE = b"SQLiteAuthenticatorStorage"
+
+    def __init__(self, path:str, pwd:str, sync_writes:bool=False):
+        super().__init__()
+        self._path = path
+        if not os.path.exists(os.path.dirname(self._path)):
+            os.mkdir(os.path.dirname(self._path))
+        #Commands can arrive on a different thread to the one that loaded
+        #the storage, but are processed one at a time
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._fernet = None
+        self._index_key = None
+        #Close the connection on any failure, including a wrong password
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            #FULL syncs the WAL on every commit, NORMAL only at checkpoints
+            self._conn.execute("PRAGMA synchronous=" + ("FULL" if sync_writes else "NORMAL"))
+            with self._conn:
+                self._conn.executescript(_SCHEMA)
+            self._prep_crypto(pwd)
+            self._settings = self._read_settings()
+        except sqlite3.DatabaseError as exp:
+            self._conn.close()
+            raise DICEAuthenticatorStorageException(
+                "Unable to open SQLite storage") from exp
+        except Exception:
+            self._conn.close()
+            raise
+
+    def close(self):
+        """Closes the database connection
+        """
+        self._conn.close()
+
+    def import_json_storage(self, json_storage:JSONAuthenticatorStorage):
+        """Imports the settings and credentials of a JSON store in a single
+        transaction. Used once when moving an existing authenticator to
+        SQLite storage, the JSON store is left unchanged.
+
+        Args:
+            json_storage (JSONAuthenticatorStorage): store to import
+
+        Raises:
+            DICEAuthenticatorStorageException: raised if the import could not be written
+        """
+        settings = {}
+        credentials = []
+        for key, value in json_storage.get_data().items():
+            if key == "_version":
+                continue
+            if key == STORAGE_KEYS.CREDENTIALS:
+                for rp_id, creds in value.items():
+                    rp_index = self._index(rp_id.encode("UTF-8"))
+                    for cred in creds:
+                        raw = bytes.fromhex(cred)
+                        cred_id = bytes.fromhex(json.loads(raw.decode("UTF-8"))[
+                            AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE.ID.value])
+                        credentials.append((cred_id,rp_index,self._fernet.encrypt(raw)))
+            elif key == STORAGE_KEYS.PIN:
+                #PIN retries and value are top level settings here
+                settings.update(value)
+            elif key == STORAGE_KEYS.SIGNATURE_COUNT:
+                settings[key] = int.from_bytes(bytes.fromhex(value),"big")
+            else:
+                settings[key] = value
+        try:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO settings(key,value) VALUES (?,?)",
+                    [(key,self._fernet.encrypt(json.dumps(value).encode("UTF-8")))
+                    for key, value in settings.items()])
+                self._conn.executemany("INSERT OR REPLACE INTO credentials" +
+                    "(id,rp_id,blob) VALUES (?,?,?)",credentials)
+        except sqlite3.Error as exp:
+            raise DICEAuthenticatorStorageException(
+                "Unable to import JSON storage") from exp
+        self._settings.update(settings)
+
+    def _prep_crypto(self, pwd:str):
+        """Derives the encryption and index keys from the password and checks
+        them against the stored check value, creating the salt and check value
+        for a new database
+
+        Args:
+            pwd (str): Password
+
+        Raises:
+            InvalidToken: raised if the password is incorrect
+        """
+        salt = self._get_meta("salt")
+        is_new = salt is None
+        if is_new:
+            salt = os.urandom(16)
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
+                length=64,salt=salt,iterations=100000,backend=_BACKEND)
+        key = kdf.derive(pwd.encode("UTF-8"))
+        self._fernet = Fernet(base64.urlsafe_b64encode(key[:32]))
+        self._index_key = key[32:]
+        if is_new:
+            with self._conn:
+                self._conn.executemany("INSERT INTO meta(key,value) VALUES (?,?)",
+                    [("version",SQLiteAuthenticatorStorage.VERSION.encode("UTF-8")),
+                    ("salt",salt),
+                    ("check",self._fernet.encrypt(SQLiteAuthenticatorStorage.CHECK_VALUE))])
+        else:
+            #Raises InvalidToken if the password is wrong
+            self._fernet.decrypt(self._get_meta("check"))
+
+    def _get_meta(self, key:str)->bytes:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?",(key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _index(self, value:bytes)->str:
+        """Gets the keyed hash of a value used in an indexed column
+
+        Args:
+            value (bytes): value to index
+
+        Returns:
+            str: hex encoded HMAC of the value
+        """
+        return hmac.new(self._index_key, value, hashlib.sha256).hexdigest()
+
+    def _read_settings(self)->dict:
+        settings = {}
+        for key, value in self._conn.execute("SELECT key, value FROM settings"):
+            settings[key] = json.loads(self._fernet.decrypt(value).decode("UTF-8"))
+        return settings
+
+    def _set_setting(self, key:str, value)->bool:
+        try:
+            token = self._fernet.encrypt(json.dumps(value).encode("UTF-8"))
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO settings(key,value) VALUES (?,?)",
+                    (key,token))
+            self._settings[key] = value
+            return True
+        except sqlite3.Error:
+            log.error("SQLite Exception writing setting", exc_info=True)
+            return False
+
+    def is_initialised(self)->bool:
+        return (STORAGE_KEYS.SIGNATURE_COUNT in self._settings and
+            STORAGE_KEYS.MASTER_KEY in self._settings)
+
+    def get_wrapping_key(self)->bytes:
+        if STORAGE_KEYS.WRAP_KEY in self._settings:
+            return bytes.fromhex(self._settings[STORAGE_KEYS.WRAP_KEY])
+        return None
+
+    def has_wrapping_key(self)->bool:
+        return STORAGE_KEYS.WRAP_KEY in self._settings
+
+    def set_wrapping_key(self, wrap_key:bytes)->bool:
+        return self._set_setting(STORAGE_KEYS.WRAP_KEY,wrap_key.hex())
+
+    def get_master_secret(self)->bytes:
+        """Gets the master secret
+
+        Should only be called when a master secret exists. Check with
+        is_initialised() to determine
+
+        Raises:
+            DICEAuthenticatorStorageException: raised if no master secret found
+
+        Returns:
+            bytes: master secret as bytes
+        """
+        if STORAGE_KEYS.MASTER_KEY in self._settings:
+            return bytes.fromhex(self._settings[STORAGE_KEYS.MASTER_KEY])
+        else:
+            raise DICEAuthenticatorStorageException("No master secret set")
+
+    def init_new(self,master_secret:bytes=None)->bool:
+        if master_secret is None:
+            master_secret = os.urandom(64)
+        return (self._set_setting(STORAGE_KEYS.MASTER_KEY,master_secret.hex()) and
+            self._set_setting(STORAGE_KEYS.SIGNATURE_COUNT,0))
+
+    def debug(self):
+        log.debug("")
+        log.debug("Starting Storage Debug Output")
+        log.debug("=============================")
+        log.debug("")
+        rp_debug = []
+        for (blob,) in self._conn.execute("SELECT blob FROM credentials ORDER BY rp_id"):
+            rp_debug.append(self._load_credential_source(blob).debug())
+        log.debug("\t%s", json.dumps(rp_debug,indent=4))
+        log.debug("")
+        log.debug("Finished Storage Debug Output")
+        log.debug("=============================")
+        log.debug("")
+
+    def get_signature_counter(self)->int:
+        return self._settings[STORAGE_KEYS.SIGNATURE_COUNT]
+
+    def update_signature_counter(self, new_counter:int)->bool:
+        return self._set_setting(STORAGE_KEYS.SIGNATURE_COUNT,new_counter)
+
+    def increment_signature_counter(self)->bool:
+        return self.update_signature_counter(self.get_signature_counter() + 1)
+
+    def _load_credential_source(self, blob:bytes)->PublicKeyCredentialSource:
+        credential_source = PublicKeyCredentialSource()
+        credential_source.from_bytes(self._fernet.decrypt(blob))
+        return credential_source
+
+    def update_credential_source(self, rp_id: str,
+                                 credential_source: PublicKeyCredentialSource) -> bool:
+        if credential_source.get_loaded_bytes() is None:
+            return False
+        data = credential_source.get_bytes()
+        if data == credential_source.get_loaded_bytes():
+            return True
+        try:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "UPDATE credentials SET blob = ? WHERE id = ? AND rp_id = ?",
+                    (self._fernet.encrypt(data),
+                    credential_source.get_id(),self._index(rp_id.encode("UTF-8"))))
+            return cursor.rowcount > 0
+        except sqlite3.Error:
+            log.error("SQLite Exception updating credential", exc_info=True)
+            return False
+
+    def add_credential_source(self,rp_id:str,user_id:bytes,
+            credential_source:PublicKeyCredentialSource)->bool:
+        try:
+            with self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO credentials" +
+                    "(id,rp_id,blob) VALUES (?,?,?)",
+                    (credential_source.get_id(),self._index(rp_id.encode("UTF-8")),
+                    self._fernet.encrypt(credential_source.get_bytes())))
+            return True
+        except sqlite3.Error:
+            log.error("SQLite Exception adding credential", exc_info=True)
+            return False
+
+    def get_credential_source(self,rp_id:str,user_id:bytes)->PublicKeyCredentialSource:
+        return self.get_credential_source_by_rp(rp_id,{user_id})
+
+    def get_credential_source_by_rp(self,rp_id:str,allow_list=None)->List[PublicKeyCredentialSource]:
+        query = "SELECT blob FROM credentials WHERE rp_id = ?"
+        args = [self._index(rp_id.encode("UTF-8"))]
+        #Checks allow list is set and not empty
+        if not allow_list is None and allow_list:
+            if isinstance(allow_list,(set,frozenset)):
+                allowed = list(allow_list)
+            else:
+                allowed = list(self.convert_allow_list_to_map(allow_list))
+            query += " AND id IN (" + ",".join("?" * len(allowed)) + ")"
+            args.extend(allowed)
+        #Keep the order credentials were added in, as JSON storage does
+        query += " ORDER BY rowid"
+        return [self._load_credential_source(blob) for (blob,) in
+            self._conn.execute(query,args)]
+
+    def get_pin_retries(self)->int:
+        if not STORAGE_KEYS.PIN_RETRIES in self._settings:
+            self.set_pin_retries(8)
+        return self._settings[STORAGE_KEYS.PIN_RETRIES]
+
+    def set_pin_retries(self, retries:int)->int:
+        self._set_setting(STORAGE_KEYS.PIN_RETRIES,retries)
+        return self._settings[STORAGE_KEYS.PIN_RETRIES]
+
+    def decrement_pin_retries(self)->int:
+        return self.set_pin_retries(self.get_pin_retries() - 1)
+
+    def get_pin(self)->bytes:
+        if STORAGE_KEYS.PIN_VALUE in self._settings:
+            return bytes.fromhex(self._settings[STORAGE_KEYS.PIN_VALUE])
+        return None
+
+    def set_pin(self, pin_value:bytes):
+        self.set_pin_retries(8)
+        return self._set_setting(STORAGE_KEYS.PIN_VALUE,pin_value.hex())
+
+    def set_uv_value(self, uv_check_value:bytes):
+        return self._set_setting(STORAGE_KEYS.UV_CHECK_VALUE,uv_check_value.hex())
+
+    def get_uv_value(self)->bytes:
+        if STORAGE_KEYS.UV_CHECK_VALUE in self._settings:
+            return bytes.fromhex(self._settings[STORAGE_KEYS.UV_CHECK_VALUE])
+        return None
+
+    def get_string(self, key:str)->str:
+        if key in self._settings:
+            return self._settings[key]
+        return None
+
+    def delete_field(self, key:str)->bool:
+        if not key in self._settings:
+            return False
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM settings WHERE key = ?",(key,))
+            self._settings.pop(key)
+            return True
+        except sqlite3.Error:
+            log.error("SQLite Exception deleting setting", exc_info=True)
+            return False
+
+    def set_string(self, key:str, data:str)->bool:
+        return self._set_setting(key,data)
+
+    def reset(self)->bool:
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM credentials")
+                self._conn.execute("DELETE FROM settings")
+            self._settings = {}
+        except sqlite3.Error:
+            log.error("SQLite Exception resetting storage", exc_info=True)
+            return False
+        return self.init_new()
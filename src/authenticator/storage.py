@@ -150,6 +150,9 @@ class DICEAuthenticatorStorage(ABC):
         """Gets credential sources using the relying party ID as an index and then applying the
         passed in allow_list, if provided
 
+        The allow_list can either be a list of PublicKeyCredentialDescriptor or a set of
+        credential IDs that has already been extracted from one.
+
         Args:
             rp_id (str): Relying party to look up
             allow_list ([type], optional): allow list of credentials. Defaults to None.
@@ -33,20 +33,50 @@ Classes:
 
 """
 import os
+import struct
+import hmac
+from typing import List
 from cryptography.hazmat.primitives import keywrap
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from ctap.credential_source import PublicKeyCredentialSource
 from crypto.credential_wrapper import CredentialWrapper
 
+_BACKEND = default_backend()
+
+#RFC 5649 alternative initial value prefix
+KWP_AIV_PREFIX = b"\xa6\x59\x59\xa6"
+
 class AESCredentialWrapper(CredentialWrapper):
     """An implementation of an AES based Credential Wrapper
 
     This can be used to encrypt and decrypt a PublicKeyCredentialSource
+    using AES Key Wrap with Padding (RFC 5649). Single credentials are
+    wrapped and unwrapped with the cryptography keywrap helpers. Batches
+    of credentials are unwrapped together, reusing one AES cipher for
+    the wrapping key.
 
     """
     def __init__(self):
         super().__init__()
         self.name = "AES"
+        self._cipher_key = None
+        self._cipher = None
+
+    def _get_cipher(self, key:bytes)->Cipher:
+        """Gets the AES-ECB cipher for the key, only constructing a new one
+        if the key has changed since the last call
+
+        Args:
+            key (bytes): AES Key
+
+        Returns:
+            Cipher: AES-ECB cipher for the key
+        """
+        if self._cipher is None or self._cipher_key != key:
+            self._cipher = Cipher(algorithms.AES(key), modes.ECB(), _BACKEND)
+            self._cipher_key = key
+        return self._cipher
 
     def wrap(self, key:bytes, credential:PublicKeyCredentialSource)->bytes:
         """wraps a PublicKeyCredentialSource in an encrypted block.
@@ -59,7 +89,7 @@ class AESCredentialWrapper(CredentialWrapper):
         Returns:
             bytes: Encrypted credential
         """
-        return keywrap.aes_key_wrap_with_padding(key,credential.get_bytes(True),default_backend())
+        return keywrap.aes_key_wrap_with_padding(key,credential.get_bytes(True),_BACKEND)
 
     def unwrap(self, key:bytes, wrapped_credential:bytes)->PublicKeyCredentialSource:
         """unwraps by decrypting a wrapped credential
@@ -68,15 +98,138 @@ class AESCredentialWrapper(CredentialWrapper):
             key (bytes): AES key
             wrapped_credential (bytes): Encrypted credential to decrypt
 
+        Raises:
+            InvalidUnwrap: raised if the wrapped credential fails the integrity check
+
+        Returns:
+            PublicKeyCredentialSource: Decrypted PublicKeyCredentialSource
+        """
+        return self._load_credential(
+            keywrap.aes_key_unwrap_with_padding(key,wrapped_credential,_BACKEND),
+            wrapped_credential)
+
+    def unwrap_batch(self, key:bytes,
+            wrapped_credentials:List[bytes])->List[PublicKeyCredentialSource]:
+        """unwraps several wrapped credentials with the same key
+
+        Credentials of the same length go through the unwrap steps together.
+        At each step the AES block of every credential in the group is
+        decrypted with a single update call on one decryptor, rather than
+        one call per credential.
+
+        Args:
+            key (bytes): AES key
+            wrapped_credentials (List[bytes]): Encrypted credentials to decrypt
+
+        Raises:
+            InvalidUnwrap: raised if any wrapped credential fails the integrity check
+
+        Returns:
+            List[PublicKeyCredentialSource]: Decrypted PublicKeyCredentialSources in
+                the same order as wrapped_credentials
+        """
+        return [self._load_credential(unwrapped, wrapped_credential)
+            for unwrapped, wrapped_credential in
+            zip(self._unwrap_all(key, wrapped_credentials), wrapped_credentials)]
+
+    def _unwrap_all(self, key:bytes, wrapped_keys:List[bytes])->List[bytes]:
+        """unwraps several AES-KWP (RFC 5649) wrapped values with the same key
+
+        Values of the same length go through the unwrap steps together, a
+        value with no others of its length is unwrapped by the keywrap helper
+
+        Args:
+            key (bytes): AES key
+            wrapped_keys (List[bytes]): wrapped values to unwrap
+
+        Raises:
+            InvalidUnwrap: raised if any wrapped value fails the integrity check
+
+        Returns:
+            List[bytes]: unwrapped values in the same order as wrapped_keys
+        """
+        groups = {}
+        for idx, wrapped_key in enumerate(wrapped_keys):
+            if len(wrapped_key) < 16 or len(wrapped_key) % 8 != 0:
+                raise keywrap.InvalidUnwrap("Wrapped value has an invalid length")
+            groups.setdefault(len(wrapped_key), []).append(idx)
+        results = [None] * len(wrapped_keys)
+        for length, indices in groups.items():
+            if len(indices) == 1:
+                results[indices[0]] = keywrap.aes_key_unwrap_with_padding(key,
+                    wrapped_keys[indices[0]],_BACKEND)
+                continue
+            decryptor = self._get_cipher(key).decryptor()
+            if length == 16:
+                data = decryptor.update(b"".join(wrapped_keys[idx] for idx in indices))
+                bufs = [data[pos:pos + 16] for pos in range(0, len(data), 16)]
+            else:
+                bufs = [bytearray(wrapped_keys[idx]) for idx in indices]
+                views = [memoryview(buf) for buf in bufs]
+                #block and output positions of each value in the batch
+                positions = range(0, 16 * len(bufs), 16)
+                blocks = bytearray(16 * len(bufs))
+                blocks_view = memoryview(blocks)
+                out = bytearray(16 * len(bufs) + 15)
+                out_view = memoryview(out)
+                update_into = decryptor.update_into
+                regs = [struct.unpack_from(">Q", buf)[0] for buf in bufs]
+                counter = 6 * (length // 8 - 1)
+                for _ in range(6):
+                    for offset in range(length - 8, 0, -8):
+                        for pos, reg_a, view in zip(positions, regs, views):
+                            struct.pack_into(">Q", blocks, pos, reg_a ^ counter)
+                            blocks_view[pos + 8:pos + 16] = view[offset:offset + 8]
+                        counter -= 1
+                        update_into(blocks, out)
+                        for k, (pos, view) in enumerate(zip(positions, views)):
+                            regs[k] = struct.unpack_from(">Q", out, pos)[0]
+                            view[offset:offset + 8] = out_view[pos + 8:pos + 16]
+                for buf, reg_a in zip(bufs, regs):
+                    struct.pack_into(">Q", buf, 0, reg_a)
+            decryptor.finalize()
+            for idx, buf in zip(indices, bufs):
+                results[idx] = self._check_padding(bytes(buf[:8]), bytes(buf[8:]))
+        return results
+
+    def _load_credential(self, unwrapped:bytes, wrapped_credential:bytes)->PublicKeyCredentialSource:
+        """Loads the credential source from unwrapped data
+
+        Args:
+            unwrapped (bytes): unwrapped credential source bytes
+            wrapped_credential (bytes): Encrypted credential, used as the credential ID
+
         Returns:
             PublicKeyCredentialSource: Decrypted PublicKeyCredentialSource
         """
-        unwrapped = keywrap.aes_key_unwrap_with_padding(key,wrapped_credential,default_backend())
         cred = PublicKeyCredentialSource()
         cred.from_bytes(unwrapped,True)
         cred.set_id(wrapped_credential)
         return cred
 
+    def _check_padding(self, reg_a:bytes, data:bytes)->bytes:
+        """Checks the integrity value and padding of unwrapped data as
+        per RFC 5649 and strips the padding
+
+        Args:
+            reg_a (bytes): recovered alternative initial value
+            data (bytes): unwrapped, padded data
+
+        Raises:
+            InvalidUnwrap: raised if the integrity value or padding is invalid
+
+        Returns:
+            bytes: unwrapped data with padding removed
+        """
+        mli = int.from_bytes(reg_a[4:], "big")
+        pad = len(data) - mli
+        #Compared in constant time, as the keywrap helper does
+        if not hmac.compare_digest(reg_a[:4], KWP_AIV_PREFIX) or not 0 <= pad < 8:
+            raise keywrap.InvalidUnwrap()
+        if not hmac.compare_digest(data[mli:], bytes(pad)):
+            raise keywrap.InvalidUnwrap()
+        return data[:mli]
+
     def generate_key(self)->bytes:
         """Generates a new wrapping key by selecting 32 bytes at random
 
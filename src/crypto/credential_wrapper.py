@@ -29,6 +29,7 @@ as used by WebAuthN to store credential sources on the Relying Party server
 
 """
 from abc import ABC, abstractmethod
+from typing import List
 from ctap.credential_source import PublicKeyCredentialSource
 class CredentialWrapper(ABC):
     """Abstract Credential Wrapper defining functions needed to
@@ -62,6 +63,24 @@ class CredentialWrapper(ABC):
             PublicKeyCredentialSource: decrypted and instantiated credential source
         """
 
+    def unwrap_batch(self, key:bytes,
+            wrapped_credentials:List[bytes])->List[PublicKeyCredentialSource]:
+        """Unwrap several wrapped public key credential sources with the same key
+
+        By default each credential is unwrapped in turn, subclasses can override
+        this to share work across the batch.
+
+        Args:
+            key (bytes): AES key bytes to use in decryption
+            wrapped_credentials (List[bytes]): encrypted credentials to unwrap
+
+        Returns:
+            List[PublicKeyCredentialSource]: decrypted and instantiated credential
+                sources in the same order as wrapped_credentials
+        """
+        return [self.unwrap(key,wrapped_credential)
+            for wrapped_credential in wrapped_credentials]
+
     @abstractmethod
     def generate_key(self)->bytes:
         """Generates a new wrapping key
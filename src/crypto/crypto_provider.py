@@ -49,6 +49,8 @@ class AuthenticatorCryptoPublicKey(ABC):
     implemented crypto algorithms. This is not intended to be instantiated
     itself.
     """
+    __slots__ = ('_pk',)
+
     def __init__(self, public_key):
         """Creates a new instance of the wrapper around a specific public key instance
 
@@ -95,6 +97,8 @@ class AuthenticatorCryptoPrivateKey(ABC):
 
     Wraps the underlying crypto private key
     """
+    __slots__ = ('_sk',)
+
     def __init__(self, private_key):
         """Creates a new instance of abtract private key
 
@@ -125,6 +129,36 @@ class AuthenticatorCryptoPrivateKey(ABC):
             bytes: signature of hashed message
         """
 
+    def get_digest_alg(self):
+        """Gets the hash that sign applies to the message, for keys that can
+        also sign a precomputed digest with sign_digest
+
+        Keys that can only sign a complete message need not override this.
+
+        Returns:
+            hashlib constructor for the hash, for example hashlib.sha256, or
+            None if the key cannot sign a digest. Defaults to None
+        """
+        return None
+
+    def sign_digest(self,digest:bytes)->bytes:
+        """Signs a digest that has already been computed from the message
+
+        Only called when get_digest_alg does not return None. The digest
+        must have been produced with the hash it returns.
+
+        Args:
+            digest (bytes): digest of the message to sign
+
+        Raises:
+            NotImplementedError: raised if the key cannot sign a digest
+
+        Returns:
+            bytes: signature of the digest
+        """
+        raise NotImplementedError("%s does not support signing a digest"
+            % type(self).__name__)
+
     @abstractmethod
     def get_encoded(self)->bytes:
         """Gets the private key in a byte encoded form
@@ -139,6 +173,8 @@ class AuthenticatorCryptoKeyPair(ABC):
 
     This is used a convenience method
     """
+    __slots__ = ('_pk','_sk')
+
     def __init__(self, public_key:AuthenticatorCryptoPublicKey,
                 private_key:AuthenticatorCryptoPrivateKey):
         """Create a new instance of the key pair with references to
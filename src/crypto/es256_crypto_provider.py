@@ -36,6 +36,7 @@ Classes:
  POSSIBILITY OF SUCH DAMAGE.
 
 """
+import hashlib
 from binascii import b2a_hex
 
 from cryptography.hazmat.primitives.asymmetric import ec
@@ -44,6 +45,7 @@ from cryptography.hazmat.primitives.serialization import (PrivateFormat,
 from cryptography.hazmat.primitives.asymmetric.ec import (EllipticCurvePublicKey,
     EllipticCurvePublicNumbers, EllipticCurvePrivateKeyWithSerialization)
 from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.utils import Prehashed
 from cryptography.hazmat.backends import default_backend
 
 from fido2.cose import ES256
@@ -51,9 +53,17 @@ from crypto.crypto_provider import (AuthenticatorCryptoProvider,
     AuthenticatorCryptoKeyPair, AuthenticatorCryptoPublicKey,
     AuthenticatorCryptoPrivateKey)
 
+_BACKEND = default_backend()
+#Signature and exchange algorithms are stateless so are shared by all keys
+_ECDSA_SHA256 = ec.ECDSA(hashes.SHA256())
+_ECDSA_PREHASHED_SHA256 = ec.ECDSA(Prehashed(hashes.SHA256()))
+_ECDH = ec.ECDH()
+
 class ECCryptoKeyPair(AuthenticatorCryptoKeyPair):
     """Creates Elliptic Curve Key Pair
     """
+    __slots__ = ()
+
     def __init__(self, private_key:EllipticCurvePrivateKeyWithSerialization):
         """Initialise Elliptic Curve Crypto Key Pair from private key
 
@@ -71,6 +81,8 @@ class ECCryptoKeyPair(AuthenticatorCryptoKeyPair):
 class ECCryptoPrivateKey(AuthenticatorCryptoPrivateKey):
     """Represents an Elliptic Curve private key
     """
+    __slots__ = ()
+
     def __init__(self, private_key:EllipticCurvePrivateKeyWithSerialization):
         """Initialise Elliptic Curve Crypto Private Key instance
 
@@ -84,7 +96,13 @@ class ECCryptoPrivateKey(AuthenticatorCryptoPrivateKey):
         return self._sk
 
     def sign(self,msg:bytes):
-        return self._sk.sign(msg,ec.ECDSA(hashes.SHA256()))
+        return self._sk.sign(msg,_ECDSA_SHA256)
+
+    def get_digest_alg(self):
+        return hashlib.sha256
+
+    def sign_digest(self,digest:bytes):
+        return self._sk.sign(digest,_ECDSA_PREHASHED_SHA256)
 
     def get_encoded(self)->bytes:
         self._sk.get_private_key().private_bytes(Encoding.PEM,PrivateFormat.PKCS8,NoEncryption())
@@ -102,14 +120,14 @@ class ECCryptoPrivateKey(AuthenticatorCryptoPrivateKey):
         Returns:
             bytes: hashed result of exchange as per CTAP standard
         """
-        hash_alg = hashes.Hash(hashes.SHA256(),default_backend())
-        hash_alg.update(self._sk.exchange(ec.ECDH(), other_public_key))
-        return hash_alg.finalize()
+        return hashlib.sha256(self._sk.exchange(_ECDH, other_public_key)).digest()
 
 class ECCryptoPublicKey(AuthenticatorCryptoPublicKey):
     """Elliptic Curve Public Key
 
     """
+    __slots__ = ()
+
     def __init__(self, public_key:EllipticCurvePublicKey):
         """Initialises an Elliptic Curve Public Key
 
@@ -138,7 +156,7 @@ class ECCryptoPublicKey(AuthenticatorCryptoPublicKey):
         """
         return ECCryptoPublicKey(EllipticCurvePublicNumbers(
                 int(b2a_hex(cose_data[-2]), 16),int(b2a_hex(cose_data[-3]), 16),
-                ec.SECP256R1()).public_key(default_backend()))
+                ec.SECP256R1()).public_key(_BACKEND))
 
 class ES256CryptoProvider(AuthenticatorCryptoProvider):
     """Instaniates an ES256 Crypto Provider
@@ -147,14 +165,16 @@ class ES256CryptoProvider(AuthenticatorCryptoProvider):
     def __init__(self):
         super().__init__()
         self._alg = -7 #cose algorithm number
+        #curve is fixed for ES256 so is only constructed once
+        self._curve = ec.SECP256R1()
 
     def create_new_key_pair(self,relying_party:str=None)->AuthenticatorCryptoKeyPair:
         #https://tools.ietf.org/html/draft-ietf-cose-webauthn-algorithms-04 specifies SECP256K1
-        return ECCryptoKeyPair(ec.generate_private_key(ec.SECP256R1,default_backend()))
+        return ECCryptoKeyPair(ec.generate_private_key(self._curve,_BACKEND))
 
     def load_key_pair(self, data:bytes)->ECCryptoKeyPair:
         return ECCryptoKeyPair(serialization.load_pem_private_key(data,
-            None, backend=default_backend()))
+            None, backend=_BACKEND))
 
     def public_key_from_cose(self, cose_data:{})->ECCryptoPublicKey:
         return ECCryptoPublicKey.from_cose(cose_data)
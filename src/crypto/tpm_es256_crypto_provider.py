@@ -37,12 +37,12 @@ Classes:
 """
 import os
 import json
+import hashlib
 from binascii import b2a_hex
 
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.asymmetric.ec import (EllipticCurvePublicKey,
     EllipticCurvePublicNumbers)
-from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 
 from fido2.cose import ES256
@@ -52,9 +52,13 @@ from crypto.crypto_provider import (AuthenticatorCryptoProvider,
 
 from crypto.tpm.ibmtpm import TPM,DICEKeyData, DICERelyingPartyKey
 
+_BACKEND = default_backend()
+
 class TPMECCryptoKeyPair(AuthenticatorCryptoKeyPair):
     """Creates Elliptic Curve Key Pair
     """
+    __slots__ = ('_private_key',)
+
     def __init__(self, private_key:DICERelyingPartyKey, tpm:TPM):
         """Initialise Elliptic Curve Crypto Key Pair from private key
 
@@ -73,6 +77,8 @@ class TPMECCryptoKeyPair(AuthenticatorCryptoKeyPair):
 class TPMECCryptoPrivateKey(AuthenticatorCryptoPrivateKey):
     """Represents an Elliptic Curve private key
     """
+    __slots__ = ('_private_key','_tpm')
+
     def __init__(self, private_key:DICERelyingPartyKey, tpm:TPM):
         """Initialise Elliptic Curve Crypto Private Key instance
 
@@ -87,9 +93,12 @@ class TPMECCryptoPrivateKey(AuthenticatorCryptoPrivateKey):
         return self._private_key
 
     def sign(self,msg:bytes):
-        hash_alg = hashes.Hash(hashes.SHA256(),default_backend())
-        hash_alg.update(msg)
-        digest= hash_alg.finalize()
+        return self.sign_digest(hashlib.sha256(msg).digest())
+
+    def get_digest_alg(self):
+        return hashlib.sha256
+
+    def sign_digest(self,digest:bytes):
         return self._tpm.sign_using_rp_key(self._private_key.username,digest,
             self._private_key.password).get_as_der_encoded_signature()
 
@@ -100,6 +109,8 @@ class TPMECCryptoPublicKey(AuthenticatorCryptoPublicKey):
     """Elliptic Curve Public Key
 
     """
+    __slots__ = ()
+
     def __init__(self, public_key:EllipticCurvePublicKey):
         """Initialises an Elliptic Curve Public Key
 
@@ -128,18 +139,37 @@ class TPMECCryptoPublicKey(AuthenticatorCryptoPublicKey):
         """
         return TPMECCryptoPublicKey(EllipticCurvePublicNumbers(
                 int(b2a_hex(cose_data[-2]), 16),int(b2a_hex(cose_data[-3]), 16),
-                ec.SECP256R1()).public_key(default_backend()))
+                ec.SECP256R1()).public_key(_BACKEND))
 
 class TPMES256CryptoProvider(AuthenticatorCryptoProvider):
     """Instaniates an ES256 Crypto Provider
 
+    The TPM is not started until the first operation that needs it, as
+    starting it and loading the user key are slow. A user key passed to
+    load_user_key is held until then as well.
+
     """
     def __init__(self):
         super().__init__()
         self._alg = -7 #cose algorithm number
-        self._tpm = TPM()
-        self._tpm.start_up_tpm(data_dir="./data/tpm")
+        self._tpm = None
         self._user_key_data = None
+        self._user_key_loaded = False
+
+    def _ensure_tpm(self)->TPM:
+        """Starts the TPM and loads any pending user key if this has not
+        already been done
+
+        Returns:
+            TPM: started TPM instance
+        """
+        if self._tpm is None:
+            self._tpm = TPM()
+            self._tpm.start_up_tpm(data_dir="./data/tpm")
+        if not self._user_key_loaded and not self._user_key_data is None:
+            self._tpm.load_user_key(self._user_key_data)
+            self._user_key_loaded = True
+        return self._tpm
 
     def create_user_key(self, username:str, password:str)->str:
         """Creates a TPM user key and returns it encoded as string for storage
@@ -151,27 +181,32 @@ class TPMES256CryptoProvider(AuthenticatorCryptoProvider):
         Returns:
             (str): JSON encoded string of the user key
         """
-        self._user_key_data=self._tpm.create_and_load_user_key(username,password)
+        tpm = self._ensure_tpm()
+        self._user_key_data=tpm.create_and_load_user_key(username,password)
+        self._user_key_loaded = True
         return json.dumps(self._user_key_data.as_json())
 
     def load_user_key(self, key_data:str):
-        """Loads the user key from JSON encoded key data
+        """Loads the user key from JSON encoded key data. The key is only
+        loaded into the TPM when it is first needed
 
         Args:
             key_data (str): JSON encoded string data
         """
         self._user_key_data = DICEKeyData.from_json(json.loads(key_data))
-        self._tpm.load_user_key(self._user_key_data)
+        self._user_key_loaded = False
 
     def create_new_key_pair(self, relying_party:str=None)->AuthenticatorCryptoKeyPair:
         #https://tools.ietf.org/html/draft-ietf-cose-webauthn-algorithms-04 specifies SECP256K1
-        return TPMECCryptoKeyPair(self._tpm.create_and_load_rp_key(relying_party,
-            os.urandom(16).hex(),self._user_key_data.password),self._tpm)
+        tpm = self._ensure_tpm()
+        return TPMECCryptoKeyPair(tpm.create_and_load_rp_key(relying_party,
+            os.urandom(16).hex(),self._user_key_data.password),tpm)
 
     def load_key_pair(self, data:bytes)->TPMECCryptoKeyPair:
+        tpm = self._ensure_tpm()
         dice_relying_party_key = DICERelyingPartyKey.from_json(json.loads(data.decode("UTF-8")))
-        self._tpm.load_rp_key(dice_relying_party_key,self._user_key_data.password)
-        return TPMECCryptoKeyPair(dice_relying_party_key,self._tpm)
+        tpm.load_rp_key(dice_relying_party_key,self._user_key_data.password)
+        return TPMECCryptoKeyPair(dice_relying_party_key,tpm)
 
     def public_key_from_cose(self, cose_data:{})->TPMECCryptoPublicKey:
         return TPMECCryptoPublicKey.from_cose(cose_data)
@@ -179,7 +214,12 @@ class TPMES256CryptoProvider(AuthenticatorCryptoProvider):
     def shutdown(self):
         self.clean_up()
     def clean_up(self):
-        """Cleans up the underlying TPM and unloads it from memory
+        """Cleans up the underlying TPM and unloads it from memory, if it
+        was started
         """
+        if self._tpm is None:
+            return
         self._tpm.flush()
         self._tpm.uninstall()
+        self._tpm = None
+        self._user_key_loaded = False
@@ -45,6 +45,9 @@ log = logging.getLogger('debug')
 class PublicKeyCredentialSource():
     """Manages a PublicKeyCredentialSource
     """
+    __slots__ = ('_alg','_type','_id','_rp_entity','_sk','_keypair',
+        '_user_handle','_other_ui','_signature_counter','_loaded_bytes')
+
     def __init__(self):
         """Initializes a new PublicKeyCredentialSource with default values
         """
@@ -177,8 +180,21 @@ class PublicKeyCredentialSource():
             without_id (bool, optional): True to exclude the ID (non-resident
             key), False to set the ID. Defaults to False.
         """
-        self._loaded_bytes = data
-        data = json.loads(data.decode('utf-8'))
+        self.from_dict(json.loads(data.decode('utf-8')),data,without_id)
+
+    def from_dict(self,data:dict,loaded_bytes:bytes, without_id=False):
+        """Loads a credential source from an already decoded JSON dictionary.
+
+        This allows storage to inspect the decoded fields, for example the
+        credential ID, before paying the cost of loading the key pair.
+
+        Args:
+            data (dict): decoded JSON of the credential source
+            loaded_bytes (bytes): the raw bytes data was decoded from
+            without_id (bool, optional): True to exclude the ID (non-resident
+            key), False to set the ID. Defaults to False.
+        """
+        self._loaded_bytes = loaded_bytes
         self._type=data[AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE.TYPE.value]
         if not without_id:
             self._id= bytes.fromhex(data[AUTHN_PUBLIC_KEY_CREDENTIAL_SOURCE.ID.value])
@@ -35,8 +35,11 @@ import os
 import logging
 import getpass
 import base64
+import hashlib
+import hmac
 #for x509 cert
 from uuid import UUID
+from typing import List, Set, Tuple
 from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
@@ -51,12 +54,14 @@ from authenticator.ui import DICEAuthenticatorListener,DICEAuthenticatorUI
 from authenticator.diceauthenticator import DICEAuthenticator
 from authenticator.datatypes import (DICEAuthenticatorException,AuthenticatorGetClientPINParameters,
     AuthenticatorGetAssertionParameters,AuthenticatorMakeCredentialParameters,
-    PublicKeyCredentialParameters,AuthenticatorVersion)
+    PublicKeyCredentialParameters,AuthenticatorVersion,PublicKeyCredentialDescriptor)
 from authenticator.cbor import (GetAssertionResp,MakeCredentialResp,GetClientPINResp,
     GetInfoResp,ResetResp,AUTHN_GETINFO_OPTION,AUTHN_GETINFO_TRANSPORT,AUTHN_GETINFO_VERSION,
     AUTHN_GETINFO_PIN_UV_PROTOCOL)
-from authenticator.storage import DICEAuthenticatorStorage
+from authenticator.storage import DICEAuthenticatorStorage, DICEAuthenticatorStorageException
 from authenticator.json_storage import EncryptedJSONAuthenticatorStorage
+from authenticator.sqlite_storage import SQLiteAuthenticatorStorage
+from authenticator.preferences import STORAGE_TYPE
 from authenticator.ui import QTAuthenticatorUI
 import ctap.constants
 from ctap.credential_source import PublicKeyCredentialSource
@@ -67,6 +72,7 @@ from ctap.attestation import AttestationObject
 
 log = logging.getLogger('debug')
 auth = logging.getLogger('debug.auth')
+_BACKEND = default_backend()
 USE_TPM=False
 class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
     """Concrete implementation of a CTAP2 authenticator
@@ -85,38 +91,73 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
 
     Args:
         storage_cls (DICEAuthenticatorStorage): a class reference to a storage object
-            which will be instantiated after the UI has loaded. It will be passed two
-            named arguments, path specifiying the string path to the storage file and
-            pwd which represents the user password. Defaults to
-            EncrypedJSONAuthenticatorStorage.
+            which will be instantiated after the UI has loaded. It will be passed three
+            named arguments, path specifiying the string path to the storage file, pwd
+            which represents the user password and sync_writes from the preferences.
+            Defaults to None, in which case the storage preference selects
+            EncrypedJSONAuthenticatorStorage or SQLiteAuthenticatorStorage.
 
             PLEASE NOTE: this must be a class reference not an instance.
 
         ui (DICEAuthenticatorUI): instance of a UI class to use for user interactions
             with the authenticator. Defaults to QTAuthenticatorUI
     """
-    def __init__(self, storage_cls:DICEAuthenticatorStorage=EncryptedJSONAuthenticatorStorage,ui:DICEAuthenticatorUI=QTAuthenticatorUI()):
+    def __init__(self, storage_cls:DICEAuthenticatorStorage=None,ui:DICEAuthenticatorUI=QTAuthenticatorUI()):
         super().__init__(ui=ui)
         self._storage_cls = storage_cls
         #prepare authenticator
         self._user_verification_capable = False
 
-        self._providers = []
+        self._providers = frozenset()
 
         self._credential_wrapper = AESCredentialWrapper()
 
-        self.get_info_resp = GetInfoResp(DICEAuthenticator.AUTHENTICATOR_AAGUID.bytes)
-        self.get_info_resp.set_auguid(DICEKey.DICEKEY_AUTHENTICATOR_AAGUID)
+        self.get_info_resp = self._create_get_info_resp()
+        #GetInfo responses indexed by whether a PIN is set, built once storage is loaded
+        self._get_info_resps = {}
 
-        self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.RESIDENT_KEY,True)
-        self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.USER_PRESENCE,True)
-        #self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.CONFIG,True)
-        self.get_info_resp.add_version(AUTHN_GETINFO_VERSION.CTAP2)
-        #self.get_info_resp.add_version(AUTHN_GETINFO_VERSION.CTAP1)
-        self.get_info_resp.add_transport(AUTHN_GETINFO_TRANSPORT.USB)
-        self.get_info_resp.add_algorithm(PublicKeyCredentialParameters(PUBLIC_KEY_ALG.ES256))
-        self.get_info_resp.add_pin_uv_supported_protocol(AUTHN_GETINFO_PIN_UV_PROTOCOL.VERSION_1)
-        #self.get_info_resp.add_algorithm(PublicKeyCredentialParameters(PUBLIC_KEY_ALG.RS256))
+    def _create_get_info_resp(self)->GetInfoResp:
+        """Creates a GetInfo response advertising the capabilities of the authenticator
+
+        Returns:
+            GetInfoResp: GetInfo response without the clientPin or uv options set
+        """
+        get_info_resp = GetInfoResp(DICEAuthenticator.AUTHENTICATOR_AAGUID.bytes)
+        get_info_resp.set_auguid(DICEKey.DICEKEY_AUTHENTICATOR_AAGUID)
+
+        get_info_resp.set_option(AUTHN_GETINFO_OPTION.RESIDENT_KEY,True)
+        get_info_resp.set_option(AUTHN_GETINFO_OPTION.USER_PRESENCE,True)
+        #get_info_resp.set_option(AUTHN_GETINFO_OPTION.CONFIG,True)
+        get_info_resp.add_version(AUTHN_GETINFO_VERSION.CTAP2)
+        #get_info_resp.add_version(AUTHN_GETINFO_VERSION.CTAP1)
+        get_info_resp.add_transport(AUTHN_GETINFO_TRANSPORT.USB)
+        get_info_resp.add_algorithm(PublicKeyCredentialParameters(PUBLIC_KEY_ALG.ES256))
+        get_info_resp.add_pin_uv_supported_protocol(AUTHN_GETINFO_PIN_UV_PROTOCOL.VERSION_1)
+        #get_info_resp.add_algorithm(PublicKeyCredentialParameters(PUBLIC_KEY_ALG.RS256))
+        return get_info_resp
+
+    def _build_get_info_resps(self):
+        """Builds and encodes the GetInfo response for both the PIN set and
+        PIN not set states, so changing the PIN state only swaps which one is
+        returned
+        """
+        self._get_info_resps = {}
+        for pin_set in (False, True):
+            get_info_resp = self._create_get_info_resp()
+            get_info_resp.set_option(AUTHN_GETINFO_OPTION.CLIENT_PIN,pin_set)
+            if self._user_verification_capable:
+                get_info_resp.set_option(AUTHN_GETINFO_OPTION.USER_VERIFICATION,True)
+            get_info_resp.get_encoded()
+            self._get_info_resps[pin_set] = get_info_resp
+        self._set_get_info_pin(not self._storage.get_pin() is None)
+
+    def _set_get_info_pin(self, pin_set:bool):
+        """Switches to the GetInfo response for the current PIN state
+
+        Args:
+            pin_set (bool): True if a PIN is set, False if not
+        """
+        self.get_info_resp = self._get_info_resps[pin_set]
 
     def validate_uv_check_value_exists(self, password:str)->bool:
         """Checks that user verification value is set and working
@@ -130,7 +171,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         if self._storage.get_uv_value() is None:
             salt = os.urandom(16)
             kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
-                length=32,salt=salt,iterations=100000,backend=default_backend())
+                length=32,salt=salt,iterations=100000,backend=_BACKEND)
             temp_key = base64.urlsafe_b64encode(kdf.derive(password.encode("UTF-8")))
             fernet = Fernet(temp_key)
             token = fernet.encrypt(os.urandom(32))
@@ -151,7 +192,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         salt = check_val[:16]
         token = check_val[16:]
         kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
-            length=32,salt=salt,iterations=100000,backend=default_backend())
+            length=32,salt=salt,iterations=100000,backend=_BACKEND)
         temp_key = base64.urlsafe_b64encode(kdf.derive(password.encode("UTF-8")))
         fernet = Fernet(temp_key)
         try:
@@ -161,37 +202,79 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
             return False
         return True
 
+    def _open_storage(self, pwd:str)->DICEAuthenticatorStorage:
+        """Opens the storage given by storage_cls, or selected by the storage
+        preference if no class was given
+
+        The first time SQLite storage is used, the contents of an existing
+        encrypted JSON store at the auth store path are imported into it.
+        The JSON store is opened first in that case, so a wrong password
+        fails before the database is created.
+
+        Args:
+            pwd (str): user password
+
+        Raises:
+            InvalidToken: raised if the password is incorrect
+            DICEAuthenticatorStorageException: raised if the storage cannot be opened
+
+        Returns:
+            DICEAuthenticatorStorage: opened storage
+        """
+        path = self._prefs.get_auth_store_path()
+        sync_writes = self._prefs.get_sync_writes()
+        if not self._storage_cls is None:
+            return self._storage_cls(path=path,pwd=pwd,sync_writes=sync_writes)
+        if self._prefs.get_storage_type() != STORAGE_TYPE.SQLITE:
+            return EncryptedJSONAuthenticatorStorage(path=path,pwd=pwd,sync_writes=sync_writes)
+
+        sqlite_path = self._prefs.get_sqlite_store_path()
+        json_storage = None
+        if os.path.exists(path) and not os.path.exists(sqlite_path):
+            json_storage = EncryptedJSONAuthenticatorStorage(path=path,pwd=pwd)
+        storage = SQLiteAuthenticatorStorage(path=sqlite_path,pwd=pwd,sync_writes=sync_writes)
+        #An empty database is also imported into, in case an earlier import failed
+        if not storage.is_initialised() and os.path.exists(path):
+            try:
+                if json_storage is None:
+                    json_storage = EncryptedJSONAuthenticatorStorage(path=path,pwd=pwd)
+                log.info("Importing JSON storage %s into %s", path, sqlite_path)
+                storage.import_json_storage(json_storage)
+            except Exception:
+                storage.close()
+                raise
+        return storage
+
     def post_ui_load(self):
         #will be called on a new thread
         log.debug("In post UI load method, asking for password")
         pwd = self._ui.get_user_password("Please enter your password:")
         log.debug("Initialising Encrypted Storage")
         try:
-            self._storage = self._storage_cls(path=self._prefs.get_auth_store_path(),pwd=pwd)
+            self._storage = self._open_storage(pwd)
 
         except InvalidToken:
             log.debug("Incorrect password entered")
             self._ui.shutdown()
             return
+        except DICEAuthenticatorStorageException:
+            log.error("Unable to open authenticator storage", exc_info=True)
+            self._ui.shutdown()
+            return
         if not self._storage.is_initialised():
             self._storage.init_new()
         #Generate PIN Key Agreement at Startup
         if not self._storage.has_wrapping_key():
             self._storage.set_wrapping_key(self._credential_wrapper.generate_key())
 
-        if not self._storage.get_pin() is None:
-            self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.CLIENT_PIN,True)
-        else:
-            self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.CLIENT_PIN,False)
-
         try:
             self.validate_uv_check_value_exists(pwd)
             self._user_verification_capable = True
-            self.get_info_resp.set_option(AUTHN_GETINFO_OPTION.USER_VERIFICATION,True)
             auth.debug("User Verification setup, advertising capability")
         except InvalidToken:
             log.debug("User verification check failed will set as not available")
             self._user_verification_capable = False
+        self._build_get_info_resps()
         #Use this to reset
         #self._storage.delete_field("TPM_USER_KEY")
         if USE_TPM:
@@ -205,12 +288,12 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
                 tpm_crypto_provider.load_user_key(self._storage.get_string("TPM_USER_KEY"))
 
             AuthenticatorCryptoProvider.add_provider(tpm_crypto_provider)
-            self._providers.append(tpm_crypto_provider.get_alg())
+            self._providers = self._providers | {tpm_crypto_provider.get_alg()}
         else:
 
             crypto_provider = ES256CryptoProvider()
             AuthenticatorCryptoProvider.add_provider(crypto_provider)
-            self._providers.append(crypto_provider.get_alg())
+            self._providers = self._providers | {crypto_provider.get_alg()}
 
     def shutdown(self):
         """Shuts down the authenticator
@@ -268,18 +351,17 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
 
         auth.debug("Make Credential called, req resident: %s, with params: %s",
             params.get_require_resident_key(), params)
-        provider = None
-        for cred_type in params.get_cred_types_and_pubkey_algs():
-            if cred_type["alg"] in self._providers:
-                provider=CRYPTO_PROVIDERS[cred_type["alg"]]
-                #provider = self._providers_idx[cred_type["alg"]]
-                auth.debug("Found matching public key algorithm: %s",
-                    PUBLIC_KEY_ALG(provider.get_alg()).name)
-                break
+        providers_idx = CRYPTO_PROVIDERS
+        supported = self._providers
+        provider = next((providers_idx[cred_type["alg"]]
+            for cred_type in params.get_cred_types_and_pubkey_algs()
+            if cred_type["alg"] in supported), None)
 
         if provider is None:
             auth.error("No matching public key provider found")
             raise Exception("No matching provider found")
+        auth.debug("Found matching public key algorithm: %s",
+            PUBLIC_KEY_ALG(provider.get_alg()).name)
 
         # We shouldn't have got here with user_verified as false having performed
         # a user verification - it should error out. As such, this will not override
@@ -290,6 +372,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
 
 
 
+        self._last_get_assertion_creds = None
         credential_source=PublicKeyCredentialSource()
         keypair = provider.create_new_key_pair(params.get_rp_entity().get_id())
         credential_source.init_new(provider.get_alg(),keypair,params.get_rp_entity(),
@@ -315,29 +398,154 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         return MakeCredentialResp(attest_object)
 
 
-    def authenticator_get_assertion(self, params:AuthenticatorGetAssertionParameters,
-            keep_alive:CTAPHIDKeepAlive) -> GetAssertionResp:
+    def _partition_allow_list(self, allow_list:List[PublicKeyCredentialDescriptor]
+            )->Tuple[Set[bytes],List[bytes]]:
+        """Splits the allow list into the IDs of resident credentials, which can be
+        looked up in storage, and wrapped non-resident credentials, which need to
+        be unwrapped. Any ID longer than CREDENTIAL_ID_SIZE is a wrapped credential
 
-        keep_alive.start(DICEKey.KEEP_ALIVE_TIME_MS)
+        Args:
+            allow_list (List[PublicKeyCredentialDescriptor]): allow list from the request
+
+        Returns:
+            Tuple[Set[bytes],List[bytes]]: set of resident credential IDs and list of
+                wrapped credential IDs
+        """
+        threshold = ctap.constants.CREDENTIAL_ID_SIZE
+        resident_ids = set()
+        wrapped_ids = []
+        for allow_cred in allow_list:
+            cred_id = allow_cred.get_id()
+            if len(cred_id) > threshold:
+                wrapped_ids.append(cred_id)
+            else:
+                resident_ids.add(cred_id)
+        return resident_ids, wrapped_ids
+
+    def _find_credentials(self, params:AuthenticatorGetAssertionParameters
+            )->List[PublicKeyCredentialSource]:
+        """Finds all credential sources matching a GetAssertion request. This
+        consists of the resident credentials for the RP that are in the allow
+        list, or all of them if there is no allow list, followed by any wrapped
+        credentials in the allow list once they have been unwrapped
+
+        Args:
+            params (AuthenticatorGetAssertionParameters): GetAssertion parameters
+
+        Raises:
+            DICEAuthenticatorException: thrown if a wrapped credential cannot be unwrapped
+
+        Returns:
+            List[PublicKeyCredentialSource]: matching credential sources, may be empty
+        """
+        resident_ids, wrapped_ids = self._partition_allow_list(params.get_allow_list())
         #First find all resident creds (could be zero)
-        creds = self._storage.get_credential_source_by_rp(params.get_rp_id(),
-            params.get_allow_list())
+        creds = []
+        if resident_ids or not wrapped_ids:
+            creds = self._storage.get_credential_source_by_rp(params.get_rp_id(),resident_ids)
 
         #Now check for any non-resident creds
-        for allow_cred in params.get_allow_list():
-            if len(allow_cred.get_id())>ctap.constants.CREDENTIAL_ID_SIZE:
-                auth.debug("Wrapped key provided, will unwrap credential source")
-                #we have a wrapped credential
-                try:
-                    creds.append(self._credential_wrapper.unwrap(
-                    self._storage.get_wrapping_key(),allow_cred.get_id()))
-                except Exception as exp:
-                    raise DICEAuthenticatorException(
-                    ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_INVALID_CREDENTIAL,
-                        "Unwrapping failed") from exp
+        if wrapped_ids:
+            self._resolve_wrapped(wrapped_ids,creds)
+        return creds
+
+    def _resolve_wrapped(self, wrapped_ids:List[bytes], creds:List[PublicKeyCredentialSource]):
+        """Unwraps the wrapped credential IDs as a single batch and appends the
+        resulting credential sources to creds
+
+        Args:
+            wrapped_ids (List[bytes]): wrapped credential IDs from the allow list
+            creds (List[PublicKeyCredentialSource]): list to append the unwrapped
+                credential sources to
+
+        Raises:
+            DICEAuthenticatorException: thrown if a wrapped credential cannot be unwrapped
+        """
+        auth.debug("%d wrapped keys provided, will unwrap credential sources",len(wrapped_ids))
+        key = self._storage.get_wrapping_key()
+        try:
+            creds.extend(self._credential_wrapper.unwrap_batch(key,wrapped_ids))
+        except Exception as exp:
+            raise DICEAuthenticatorException(
+            ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_INVALID_CREDENTIAL,
+                "Unwrapping failed") from exp
+
+    def _sign_assertion(self, credential_source:PublicKeyCredentialSource,
+            authenticator_data:bytes, client_data_hash:bytes)->bytes:
+        """Signs the authenticator data followed by the client data hash with the
+        credential's private key. If the key can sign a digest, the two are hashed
+        incrementally with the key's hash and the digest signed directly, so they
+        are never concatenated. Otherwise the concatenated data is passed to sign
 
+        Args:
+            credential_source (PublicKeyCredentialSource): credential to sign with
+            authenticator_data (bytes): authenticator data of the assertion
+            client_data_hash (bytes): hash of the client data from the request
 
+        Returns:
+            bytes: DER encoded signature
+        """
+        private_key = credential_source.get_private_key()
+        digest_alg = private_key.get_digest_alg()
+        if digest_alg is None:
+            return private_key.sign(authenticator_data + client_data_hash)
+        digest = digest_alg(authenticator_data)
+        digest.update(client_data_hash)
+        return private_key.sign_digest(digest.digest())
+
+    def _create_assertion_response(self, credential_source:PublicKeyCredentialSource,
+            authenticator_data:bytes, client_data_hash:bytes, number_of_credentials:int)->dict:
+        """Signs the assertion and creates the response content shared by
+        GetAssertion and GetNextAssertion, then increments the credential's
+        signature counter
+
+        The keys are inserted in canonical CBOR order so the encoder's sort
+        has nothing to reorder. The response contains the following data
+            credential  0x01    definite length map (CBOR major type 5).
+            authData    0x02    byte string (CBOR major type 2).
+            signature   0x03    byte string (CBOR major type 2).
+            publicKeyCredentialUserEntity   0x04    definite length map (CBOR major type 5).
+            numberOfCredentials 0x05    unsigned integer(CBOR major type 0).
+
+        Args:
+            credential_source (PublicKeyCredentialSource): credential asserted
+            authenticator_data (bytes): authenticator data of the assertion
+            client_data_hash (bytes): hash of the client data from the request
+            number_of_credentials (int): number of credentials found for the request
+
+        Returns:
+            dict: response content
+        """
+        response = {
+            1:credential_source.get_public_key_credential_descriptor(),
+            2:authenticator_data,
+            3:self._sign_assertion(credential_source,authenticator_data,client_data_hash),
+            4:credential_source.get_user_entity(),
+            5:number_of_credentials
+        }
+        credential_source.increment_signature_counter()
+        return response
 
+    def _update_credential_source(self, rp_id:str,
+            credential_source:PublicKeyCredentialSource):
+        """Writes an updated resident credential source back to storage. Wrapped
+        credentials are not held in storage, so there is nothing to write for them
+
+        Args:
+            rp_id (str): Relying party ID
+            credential_source (PublicKeyCredentialSource): credential source to update
+        """
+        if len(credential_source.get_id()) > ctap.constants.CREDENTIAL_ID_SIZE:
+            return
+        self._storage.update_credential_source(rp_id,credential_source)
+
+    def authenticator_get_assertion(self, params:AuthenticatorGetAssertionParameters,
+            keep_alive:CTAPHIDKeepAlive) -> GetAssertionResp:
+
+        keep_alive.start(DICEKey.KEEP_ALIVE_TIME_MS)
+        #Only the most recent GetAssertion can be followed by GetNextAssertion
+        self._last_get_assertion_creds = None
+        creds = self._find_credentials(params)
         number_of_credentials = len(creds)
 
         if number_of_credentials < 1:
@@ -377,41 +585,20 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         authenticator_data = self._get_authenticator_data_minus_creds(
             credential_source,user_presence,user_verified)
 
-        # Contains the following data
-        #   credential  0x01    definite length map (CBOR major type 5).
-        #   authData 	0x02 	byte string (CBOR major type 2).
-        #   signature 	0x03 	byte string (CBOR major type 2).
-        #   publicKeyCredentialUserEntity 	0x04 	definite length map (CBOR major type 5).
-        #   numberOfCredentials 	0x05 	unsigned integer(CBOR major type 0).
-        response = {}
-        response[2]=authenticator_data
-        response[3]=credential_source.get_private_key().sign(authenticator_data + params.get_hash())
-        credential_source.increment_signature_counter()
-        response[4]=credential_source.get_user_entity()
-        response[5]=number_of_credentials
-        #We put this last so the returned value can be
-        # updated - not sure this actually has any impact
-        response[1]=credential_source.get_public_key_credential_descriptor()
-        self._storage.update_credential_source(params.get_rp_id(),credential_source)
+        response = self._create_assertion_response(credential_source,authenticator_data,
+            params.get_hash(),number_of_credentials)
+        self._update_credential_source(params.get_rp_id(),credential_source)
+        #Only keep the credentials for GetNextAssertion once the checks have passed
+        if number_of_credentials > 1:
+            self._last_get_assertion_creds = creds
         keep_alive.stop()
         return GetAssertionResp(response,number_of_credentials)
 
     def authenticator_get_next_assertion(self, params:AuthenticatorGetAssertionParameters,idx:int,
             keep_alive:CTAPHIDKeepAlive) -> GetAssertionResp:
-        creds = self._storage.get_credential_source_by_rp(params.get_rp_entity().get_id(),
-            params.get_allow_list())
-        #Now check for any non-resident creds
-        for allow_cred in params.get_allow_list():
-            if len(allow_cred.get_id())>ctap.constants.CREDENTIAL_ID_SIZE:
-                auth.debug("Wrapped key provided, will unwrap credential source")
-                #we have a wrapped credential
-                try:
-                    creds.append(self._credential_wrapper.unwrap(
-                        self._storage.get_wrapping_key(),allow_cred.get_id()))
-                except Exception as exp:
-                    raise DICEAuthenticatorException(
-                    ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_INVALID_CREDENTIAL,
-                        "Unwrapping failed") from exp
+        creds = self._last_get_assertion_creds
+        if creds is None:
+            creds = self._find_credentials(params)
         number_of_credentials = len(creds)
         if number_of_credentials < 1:
             raise DICEAuthenticatorException(
@@ -419,32 +606,22 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         if idx >= number_of_credentials:
             raise DICEAuthenticatorException(ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_NOT_ALLOWED)
 
+        if idx == number_of_credentials - 1:
+            self._last_get_assertion_creds = None
+
         credential_source = creds[idx]
         authenticator_data = self._get_authenticator_data_minus_creds(credential_source,True)
 
-        # Consists of
-        # credential 	0x01 	definite length map (CBOR major type 5).
-        # authData 	0x02 	byte string (CBOR major type 2).
-        # signature 	0x03 	byte string (CBOR major type 2).
-        # publicKeyCredentialUserEntity 	0x04 	definite length map (CBOR major type 5).
-        # numberOfCredentials 	0x05 	unsigned integer(CBOR major type 0).
-
-
-        response = {}
-        response[2]=authenticator_data
-        response[3]=credential_source.get_private_key().sign(authenticator_data + params.get_hash())
-        credential_source.increment_signature_counter()
-        response[4]=credential_source.get_user_entity()
-        response[5]=number_of_credentials
-        #We put this last so the returned value can be
-        # updated - not sure this actually has any impact
-        response[1]=credential_source.get_public_key_credential_descriptor()
-
-        self._storage.update_credential_source(params.get_rp_id(),credential_source)
+        response = self._create_assertion_response(credential_source,authenticator_data,
+            params.get_hash(),number_of_credentials)
+        self._update_credential_source(params.get_rp_id(),credential_source)
         return GetAssertionResp(response,number_of_credentials)
 
     def authenticator_reset(self, keep_alive:CTAPHIDKeepAlive) -> ResetResp:
+        self._clear_shared_secrets()
+        self._last_get_assertion_creds = None
         if self._storage.reset():
+            self._set_get_info_pin(False)
             return ResetResp()
         raise DICEAuthenticatorException(ctap.constants.CTAP_STATUS_CODE.CTAP1_ERR_OTHER)
 
@@ -469,7 +646,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         #TODO generalise and remove hard coding to cose parameters
         shared_secret = self._generate_shared_secret(params.get_key_agreement())
         check = self._calculate_pin_auth(shared_secret,params.get_new_pin_enc())
-        if not check[0:16] == params.get_pin_auth()[0:16]:
+        if not hmac.compare_digest(check[0:16],params.get_pin_auth()[0:16]):
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_AUTH_INVALID,"Auth PIN did not match")
 
@@ -479,7 +656,8 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         if len(pin)<4:
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_POLICY_VIOLATION, "PIN too short")
-        self._storage.set_pin(self._sha256(pin)[:16])
+        self._storage.set_pin(hashlib.sha256(pin.encode()).digest()[:16])
+        self._set_get_info_pin(True)
         return GetClientPINResp()
 
     def authenticator_get_client_pin_change_pin(self, params:AuthenticatorGetClientPINParameters,
@@ -492,7 +670,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         shared_secret = self._generate_shared_secret(params.get_key_agreement())
         check = self._calculate_pin_auth(shared_secret,params.get_new_pin_enc(),
             params.get_pin_hash_enc())
-        if not check[0:16] == params.get_pin_auth()[0:16]:
+        if not hmac.compare_digest(check[0:16],params.get_pin_auth()[0:16]):
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_AUTH_INVALID,"Auth PIN did not match")
 
@@ -500,7 +678,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         decrypted_pin_hash = self._decrypt_value(shared_secret,params.get_pin_hash_enc())
         stored_pin = self._storage.get_pin()
 
-        if not stored_pin[:16] == decrypted_pin_hash[:16]:
+        if not hmac.compare_digest(stored_pin[:16],decrypted_pin_hash[:16]):
             #TODO handle run out of tries and successive lock
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_INVALID, "PIN invalid")
@@ -512,7 +690,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_POLICY_VIOLATION, "PIN too short")
 
-        self._storage.set_pin(self._sha256(pin)[:16])
+        self._storage.set_pin(hashlib.sha256(pin.encode()).digest()[:16])
         self._storage.set_pin_retries(8)
         return GetClientPINResp()
 
@@ -529,7 +707,7 @@ class DICEKey(DICEAuthenticator,DICEAuthenticatorListener):
         decrypted_pin_hash = self._decrypt_value(shared_secret,params.get_pin_hash_enc())
         stored_pin = self._storage.get_pin()
 
-        if not stored_pin[:16] == decrypted_pin_hash[:16]:
+        if not hmac.compare_digest(stored_pin[:16],decrypted_pin_hash[:16]):
             #TODO handle run out of tries and successive lock
             raise DICEAuthenticatorException(
                 ctap.constants.CTAP_STATUS_CODE.CTAP2_ERR_PIN_INVALID, "PIN invalid")
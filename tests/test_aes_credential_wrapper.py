@@ -0,0 +1,126 @@
+"""Tests for the batched AES-KWP unwrap in AESCredentialWrapper
+
+Run from the repository root with python -m unittest discover tests
+"""
+"""
+ © Copyright 2020-2021 University of Surrey
+
+ Redistribution and use in source and binary forms, with or without
+ modification, are permitted provided that the following conditions are met:
+
+ 1. Redistributions of source code must retain the above copyright notice,
+ this list of conditions and the following disclaimer.
+
+ 2. Redistributions in binary form must reproduce the above copyright notice,
+ this list of conditions and the following disclaimer in the documentation
+ and/or other materials provided with the distribution.
+
+ THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+ LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+ CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+ SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+ INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+ CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+ POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from cryptography.hazmat.primitives import keywrap
+from cryptography.hazmat.backends import default_backend
+
+from crypto.aes_credential_wrapper import AESCredentialWrapper
+from crypto.crypto_provider import AuthenticatorCryptoProvider
+from crypto.es256_crypto_provider import ES256CryptoProvider
+from ctap.credential_source import PublicKeyCredentialSource
+from authenticator.datatypes import PublicKeyCredentialRpEntity, PublicKeyCredentialUserEntity
+
+_BACKEND = default_backend()
+
+#RFC 5649 section 6 test vectors, all with the same 192-bit KEK
+RFC5649_KEK = bytes.fromhex("5840df6e29b02af1ab493b705bf16ea1ae8338f4dcc176a8")
+RFC5649_VECTORS = [
+    (bytes.fromhex("c37b7e6492584340bed12207808941155068f738"),
+        bytes.fromhex("138bdeaa9b8fa7fc61f97742e72248ee5ae6ae5360d1ae6a5f54f373fa543b6a")),
+    (bytes.fromhex("466f7250617369"),
+        bytes.fromhex("afbeb0f07dfbf5419200f2ccb50bb24f"))
+]
+
+class TestAESCredentialWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.wrapper = AESCredentialWrapper()
+        #Fixed seed so any failure can be reproduced
+        self.rand = random.Random(5649)
+
+    def _random_bytes(self, length:int)->bytes:
+        return bytes(self.rand.getrandbits(8) for _ in range(length))
+
+    def test_rfc5649_vectors(self):
+        for plaintext, wrapped in RFC5649_VECTORS:
+            #A pair of the same length goes through the batched steps,
+            #a single value through the keywrap helper
+            self.assertEqual(self.wrapper._unwrap_all(RFC5649_KEK, [wrapped, wrapped]),
+                [plaintext, plaintext])
+            self.assertEqual(self.wrapper._unwrap_all(RFC5649_KEK, [wrapped]), [plaintext])
+
+    def test_matches_keywrap(self):
+        for _ in range(50):
+            key = self._random_bytes(32)
+            plaintexts = [self._random_bytes(self.rand.choice([1, 7, 8, 9, 40, 333, 432]))
+                for _ in range(self.rand.randint(1, 8))]
+            wrapped = [keywrap.aes_key_wrap_with_padding(key, plaintext, _BACKEND)
+                for plaintext in plaintexts]
+            self.assertEqual(self.wrapper._unwrap_all(key, wrapped), plaintexts)
+
+    def test_tampered_value_rejected(self):
+        key = self._random_bytes(32)
+        for length in (7, 333):
+            wrapped = [keywrap.aes_key_wrap_with_padding(key, self._random_bytes(length), _BACKEND)
+                for _ in range(3)]
+            for pos in (0, len(wrapped[1]) - 1):
+                tampered = list(wrapped)
+                value = bytearray(tampered[1])
+                value[pos] ^= 1
+                tampered[1] = bytes(value)
+                with self.assertRaises(keywrap.InvalidUnwrap):
+                    self.wrapper._unwrap_all(key, tampered)
+
+    def test_wrong_key_rejected(self):
+        wrapped = [RFC5649_VECTORS[0][1]] * 2
+        with self.assertRaises(keywrap.InvalidUnwrap):
+            self.wrapper._unwrap_all(bytes(24), wrapped)
+
+    def test_invalid_length_rejected(self):
+        with self.assertRaises(keywrap.InvalidUnwrap):
+            self.wrapper._unwrap_all(RFC5649_KEK, [bytes(20), bytes(20)])
+
+    def test_unwrap_batch_credentials(self):
+        provider = ES256CryptoProvider()
+        #Unwrapped credentials load their key pair through the registered provider
+        AuthenticatorCryptoProvider.add_provider(provider)
+        key = self.wrapper.generate_key()
+        credentials = []
+        for user in (b"user1", b"user2", b"user3"):
+            credential = PublicKeyCredentialSource()
+            credential.init_new(provider.get_alg(), provider.create_new_key_pair(),
+                PublicKeyCredentialRpEntity({"id":"example.com","name":"Example"}),
+                PublicKeyCredentialUserEntity({"id":user,"name":"user"}))
+            credentials.append(credential)
+        wrapped = [self.wrapper.wrap(key, credential) for credential in credentials]
+        unwrapped = self.wrapper.unwrap_batch(key, wrapped)
+        for credential, wrapped_credential, result in zip(credentials, wrapped, unwrapped):
+            self.assertEqual(result.get_id(), wrapped_credential)
+            self.assertEqual(result.get_bytes(True), credential.get_bytes(True))
+
+if __name__ == "__main__":
+    unittest.main()